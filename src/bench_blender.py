@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+""" Benchmarks the Python overhead of the Blender-side scripts against
+an in-process fake bpy (see fake_bpy.py), so they can be timed without
+Blender.
+
+Times render_runner.blender_run's scene loop, create_scenes.create_polys
+and estimate_mass.get_com_moi, writes the results as JSON and, given a
+baseline JSON from an earlier run, flags (and exits non-zero on)
+regressions. Behavior checks against the same fake live in
+test_blender_scripts.py.
+
+Example:
+  python bench_blender.py -o bench.json
+  python bench_blender.py --baseline bench.json
+"""
+# Standard
+from argparse import ArgumentParser
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+# Use the fake Blender modules and a throwaway cache directory.
+SRC = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SRC)
+sys.path.insert(0, os.path.join(SRC, "demo"))
+CACHE = tempfile.mkdtemp(prefix="bench_cache_")
+atexit.register(shutil.rmtree, CACHE, ignore_errors=True)
+os.environ["BLENDERTOOLS_CACHE"] = CACHE
+import fake_bpy
+recorder = fake_bpy.install()
+import create_scenes
+import estimate_mass
+import render_runner
+
+
+def bench_blender_run(n=1000):
+    """ Render 'n' scenes with blender_run. Returns the number of
+    calls (scenes)."""
+    fake_bpy.reset()
+    fake_bpy.new_scenes(n)
+    render_runner.blender_run(False, device_t="CPU", scenes=[0, n],
+                              samples=16, frame=1)
+    return n
+
+
+def bench_create_polys(n=10000, seed=0):
+    """ Create 'n' random polys (half extruded from xy, half with z).
+    Returns the number of calls (polys)."""
+    fake_bpy.reset()
+    rnd = random.Random(seed).random
+    polys = []
+    for i in range(n):
+        dims = 2 if i % 2 else 3
+        polys.append([[rnd() for _ in range(dims)] for _ in range(6)])
+    create_scenes.create_polys(polys)
+    return n
+
+
+def bench_get_com_moi(count=1000000):
+    """ Estimate com/moi of an object with 'count' particles. Returns
+    the number of calls (particles)."""
+    fake_bpy.reset()
+    obj = fake_bpy.Object("Cube")
+    bpy = fake_bpy.bpy
+    bpy.context.scene.objects.append(obj)
+    bpy.context.scene.objects.active = obj
+    estimate_mass.get_com_moi(obj, count=count)
+    return count
+
+
+BENCHMARKS = (
+    ("blender_run", bench_blender_run),
+    ("create_polys", bench_create_polys),
+    ("get_com_moi", bench_get_com_moi),
+)
+
+
+def run_benchmark(func, repeat=3):
+    """ Run 'func' once to warm up, then 'repeat' times. Returns a dict
+    of results from the fastest run."""
+    func()
+    best = None
+    for _ in range(repeat):
+        t0 = time.time()
+        calls = func()
+        total = time.time() - t0
+        if best is None or total < best[0]:
+            best = (total, calls, len(recorder.ops), len(recorder.writes))
+    total, calls, ops, writes = best
+    return {"total_s": total, "calls": calls,
+            "per_call_us": total / calls * 1e6, "ops": ops,
+            "writes": writes}
+
+
+def baseline_mismatch(results, baseline):
+    """ Return the fields ("host", "python") that differ between
+    'results' and 'baseline'; timings are only comparable if none do."""
+    return [k for k in ("host", "python")
+            if results.get(k) != baseline.get(k)]
+
+
+def regressions(results, baseline, tolerance):
+    """ Return the names of benchmarks whose per-call time is more than
+    'tolerance' (a fraction) slower than in 'baseline'."""
+    slow = []
+    for name, res in results["benchmarks"].items():
+        base = baseline.get("benchmarks", {}).get(name)
+        if base and res["per_call_us"] > base["per_call_us"] * (1 + tolerance):
+            slow.append(name)
+    return slow
+
+
+if __name__ == "__main__":
+    ## Cmd line interface.
+    parser = ArgumentParser(description=__doc__)
+    # Argument: repeat.
+    parser.add_argument("--repeat", "-r", type=int, default=3,
+                        help="Timed runs per benchmark (the best is kept).")
+    # Argument: benchmarks to run.
+    parser.add_argument("--only", nargs="+", default=None,
+                        choices=[name for name, func in BENCHMARKS],
+                        help="Only run these benchmarks.")
+    # Argument: output file name.
+    parser.add_argument("-o", dest="outname", default=None,
+                        help="Output .json file. Defaults to stdout.")
+    # Argument: baseline file name.
+    parser.add_argument("--baseline", default=None,
+                        help="Baseline .json file to check for regressions.")
+    # Argument: tolerance.
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown vs. the baseline (fraction).")
+    parsed = parser.parse_args()
+    results = {"python": platform.python_version(),
+               "host": platform.node(), "benchmarks": {}}
+    # Keep the scripts' own printing out of the report.
+    stdout = sys.stdout
+    for name, func in BENCHMARKS:
+        if parsed.only and name not in parsed.only:
+            continue
+        sys.stdout = open(os.devnull, "w")
+        try:
+            results["benchmarks"][name] = run_benchmark(
+                func, repeat=parsed.repeat)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    status = 0
+    if parsed.baseline:
+        with open(parsed.baseline, "r") as fid:
+            baseline = json.load(fid)
+        mismatch = baseline_mismatch(results, baseline)
+        if mismatch:
+            # Timings from another machine or Python aren't comparable.
+            print("Not comparing with baseline: %s differ(s)" %
+                  ", ".join(mismatch), file=sys.stderr)
+            results["regressions"] = None
+            status = 2
+        else:
+            slow = regressions(results, baseline, parsed.tolerance)
+            results["regressions"] = slow
+            if slow:
+                print("Regressions: %s" % ", ".join(slow), file=sys.stderr)
+                status = 1
+    if parsed.outname:
+        with open(parsed.outname, "w") as fid:
+            json.dump(results, fid, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+    sys.exit(status)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+""" Benchmarks command line startup (import) time of the tools.
+
+Each command is run repeatedly in a fresh Python process, and the
+best and mean wall times are printed.
+"""
+# Standard
+from argparse import ArgumentParser
+import os
+import subprocess
+import sys
+import time
+
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# (name, arguments to the Python interpreter)
+COMMANDS = (
+    ("python", ["-c", "pass"]),
+    ("import exrtoimg", ["-c", "import exrtoimg"]),
+    ("exrtoimg --help", [os.path.join(SRC, "exrtoimg.py"), "--help"]),
+    ("import render_runner", ["-c", "import render_runner"]),
+    ("render_runner --help", [os.path.join(SRC, "render_runner.py"), "--",
+                              "--help", "--no-kill"]),
+    ("render_regions --help", [os.path.join(SRC, "render_regions.py"),
+                               "--help"]),
+)
+
+
+def time_command(args, repeat=20):
+    """ Run 'args' with this interpreter 'repeat' times and return the
+    list of wall times in seconds."""
+    cmd = [sys.executable] + list(args)
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(repeat):
+            t0 = time.time()
+            subprocess.call(cmd, cwd=SRC, stdout=devnull, stderr=devnull)
+            times.append(time.time() - t0)
+    return times
+
+
+if __name__ == "__main__":
+    ## Cmd line interface.
+    parser = ArgumentParser(description=__doc__)
+    # Argument: repeat.
+    parser.add_argument("--repeat", "-r", type=int, default=20,
+                        help="Number of runs per command.")
+    parsed = parser.parse_args()
+    print("{:<24} {:>10} {:>10}".format("command", "best (ms)", "mean (ms)"))
+    for name, args in COMMANDS:
+        times = time_command(args, repeat=parsed.repeat)
+        print("{:<24} {:>10.1f} {:>10.1f}".format(
+            name, min(times) * 1e3, sum(times) / len(times) * 1e3))
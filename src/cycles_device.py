@@ -0,0 +1,174 @@
+""" Probes, caches and selects Cycles compute devices.
+
+Listing devices requires switching
+'user_preferences.system.compute_device_type' through every device
+type, which is slow, so the inventory is probed once and cached to a
+JSON file keyed by Blender version and hostname. Selecting a device
+tries it directly instead, so a stale cache can't hide a GPU.
+"""
+import json
+import os
+import socket
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+class DeviceError(Exception):
+    pass
+
+
+# Compute device types that render on the GPU, in order of preference.
+gpu_devices = ("CUDA", "OPENCL")
+
+# Default location of the device inventory cache.
+CACHE_DIR = os.environ.get(
+    "BLENDERTOOLS_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "blendertools"))
+
+
+def system_prefs(bcups=None):
+    """ Return Blender's system user preferences (or 'bcups' if it is
+    given, e.g. a fake preferences object)."""
+    if bcups is None:
+        bcups = bpy.context.user_preferences.system
+    return bcups
+
+
+def cache_key(version=None, hostname=None):
+    """ Return the cache key for a Blender version and hostname."""
+    if version is None:
+        version = bpy.app.version_string if bpy else "unknown"
+    if hostname is None:
+        hostname = socket.gethostname()
+    return "{}@{}".format(version, hostname)
+
+
+def cache_file(key, cache_dir=None):
+    """ Return the cache file name for 'key'."""
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    safe = "".join(c if c.isalnum() or c in "-_.@" else "_" for c in key)
+    return os.path.join(cache_dir, "devices_{}.json".format(safe))
+
+
+def load_cache(key, cache_dir=None):
+    """ Load a cached device inventory, or return None if there isn't
+    a valid one."""
+    fn = cache_file(key, cache_dir=cache_dir)
+    try:
+        with open(fn, "r") as fid:
+            devices = json.load(fid)
+    except (IOError, OSError, ValueError):
+        return None
+    if not isinstance(devices, dict):
+        return None
+    return devices
+
+
+def write_json(filename, data):
+    """ Write 'data' to JSON file 'filename' atomically: it is written
+    to a temporary file and moved in place, so concurrent jobs never
+    read a partial file."""
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError:
+        # Directory already exists.
+        pass
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    with open(tmp, "w") as fid:
+        json.dump(data, fid, indent=2, sort_keys=True)
+    os.replace(tmp, filename)
+
+
+def save_cache(key, devices, cache_dir=None):
+    """ Save a device inventory to the cache."""
+    write_json(cache_file(key, cache_dir=cache_dir), devices)
+
+
+def probe_devices(bcups=None):
+    """ Return a dict mapping each compute device type to its list of
+    devices. This cycles through every device type, so it is slow."""
+    bcups = system_prefs(bcups)
+    bcupsbp = bcups.bl_rna.properties
+    current_device_type = bcups.compute_device_type
+    device_types = bcupsbp["compute_device_type"].enum_items.keys()
+    devices = {}
+    try:
+        for dt in device_types:
+            bcups.compute_device_type = dt
+            devices[dt] = list(bcupsbp["compute_device"].enum_items.keys())
+    finally:
+        # Restore the initial device type.
+        bcups.compute_device_type = current_device_type
+    return devices
+
+
+def get_devices(bcups=None, key=None, cache_dir=None, refresh=False):
+    """ Return the device inventory, probing only if there isn't a
+    cached one (or 'refresh' is set)."""
+    if key is None:
+        key = cache_key()
+    devices = None if refresh else load_cache(key, cache_dir=cache_dir)
+    if devices is None:
+        devices = probe_devices(bcups)
+        try:
+            save_cache(key, devices, cache_dir=cache_dir)
+        except (IOError, OSError) as err:
+            print("Could not cache devices: {}".format(err))
+    return devices
+
+
+def set_device(device_t, bcups=None):
+    """ Select compute device type 'device_t' ("CUDA", "OPENCL" or
+    "CPU") and return the matching Cycles device ("GPU" or "CPU").
+    Raises DeviceError if it can't be selected."""
+    bcups = system_prefs(bcups)
+    if device_t in gpu_devices:
+        bcups.compute_device_type = device_t
+        prefix = device_t
+        device = "GPU"
+    else:
+        bcups.compute_device_type = "NONE"
+        prefix = "CPU"
+        device = "CPU"
+    # Print devices.
+    print(bcups.compute_device_type, bcups.compute_device)
+    if not bcups.compute_device.startswith(prefix):
+        raise DeviceError("Failed to set compute device: %s" % prefix)
+    return device
+
+
+def select_best_device(preference=None, bcups=None):
+    """ Select the first device type in 'preference' (defaults to the
+    GPU types then "CPU") that set_device can select, and return the
+    Cycles device ("GPU" or "CPU"). Falls back to the CPU instead of
+    raising DeviceError.
+
+    The cached inventory isn't consulted: it may predate a GPU or its
+    driver, and trying a device type is cheap."""
+    bcups = system_prefs(bcups)
+    if preference is None:
+        preference = gpu_devices + ("CPU",)
+    elif isinstance(preference, str):
+        preference = (preference,)
+    for device_t in preference:
+        try:
+            return set_device(device_t, bcups)
+        except (DeviceError, TypeError) as err:
+            # Blender raises TypeError for device types it doesn't know.
+            print(err)
+    # Nothing in the preference list worked, so fall back to the CPU.
+    bcups.compute_device_type = "NONE"
+    print(bcups.compute_device_type, bcups.compute_device)
+    return "CPU"
+
+
+def set_scenes_device(device, scenes=None):
+    """ Set the Cycles device of every scene in 'scenes' (defaults to
+    all scenes)."""
+    if scenes is None:
+        scenes = bpy.data.scenes
+    for scene in scenes:
+        setattr(scene.cycles, "device", device)
@@ -216,3 +216,54 @@ def convex_hull(obj=None):
     aobj(obja)
     for o in objs:
         o.select = True
+
+
+def mesh_arrays(obj):
+    """ Return obj's world-space vertices and triangles as numpy arrays
+    (for mass_library). Raises ValueError if obj's mesh isn't closed."""
+    import numpy as np
+    # Initialize new BMesh.
+    bm = bmesh.new()
+    # Set up the BMesh from the obj.
+    bm.from_object(obj, bpy.context.scene)
+    # Volume sampling needs a closed mesh: every edge on two faces.
+    if not all(len(e.link_faces) == 2 for e in bm.edges):
+        bm.free()
+        raise ValueError("Mesh is not closed: {}".format(obj.name))
+    # Split faces into triangles.
+    bmesh.ops.triangulate(bm, faces=bm.faces)
+    bm.verts.index_update()
+    mat = obj.matrix_world
+    verts = np.array([(mat * v.co)[:] for v in bm.verts], dtype=np.float64)
+    tris = np.array([[v.index for v in f.verts] for f in bm.faces],
+                    dtype=np.int64).reshape(-1, 3)
+    bm.free()
+    return verts, tris
+
+
+def save_library(filename, objs=None):
+    """ Save the meshes of objs (defaults to the scene's mesh objects)
+    to a .npz library for mass_library. Open meshes are skipped rather
+    than stopping the export; returns the skipped objects' names."""
+    import numpy as np
+    from mass_library import pack_library
+    if objs is None:
+        objs = [o for o in bpy.context.scene.objects if o.type == "MESH"]
+    names = []
+    meshes = []
+    skipped = []
+    for obj in objs:
+        try:
+            meshes.append(mesh_arrays(obj))
+        except ValueError as err:
+            print(err)
+            skipped.append(obj.name)
+        else:
+            names.append(obj.name)
+    verts, tris, vert_offsets, tri_offsets = pack_library(meshes)
+    np.savez(filename, names=np.array(names), verts=verts, tris=tris,
+             vert_offsets=vert_offsets, tri_offsets=tri_offsets)
+    if skipped:
+        print("Skipped {} open mesh(es): {}".format(len(skipped),
+                                                   ", ".join(skipped)))
+    return skipped
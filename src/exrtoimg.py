@@ -7,22 +7,19 @@ Peter Battaglia
 """
 # Standard
 from argparse import Action, ArgumentError, ArgumentParser
+from functools import reduce
 import glob
 from math import log10
 from operator import add
 import os
 import sys
-# External
-import Imath
-import OpenEXR
-import numpy as np
-from scipy.misc import imsave
-#
-from pdb import set_trace as BP
+# External: Imath, OpenEXR, numpy and scipy are imported where they are
+# used, so "--help" and argument errors don't pay for loading them.
 
 
 def load_exr(filename):
     """ Loads .exr file."""
+    import OpenEXR
     exrimg = OpenEXR.InputFile(filename)
     return exrimg
 
@@ -37,9 +34,11 @@ def get_exr_dims(exrimg):
 def get_channels(exrimg, outchans="RGBA"):
     """ Get the separate channels.
     Possible values are: R, G, B, A, Z"""
+    import Imath
+    import numpy as np
+
     def fromstr(s, width, height):
-        mat = np.fromstring(s, dtype=np.float16)
-        mat = mat.reshape(height, width)
+        mat = np.frombuffer(s, dtype=np.float16).reshape(height, width)
         return mat
 
     w, h = get_exr_dims(exrimg)
@@ -48,14 +47,11 @@ def get_channels(exrimg, outchans="RGBA"):
     return channels
 
 
-def convert(inname, outname, outchans, normchans, nanfill):
-    """ Convert one file."""
-    # Load the .exr file.
-    exrimg = load_exr(inname)
-    # Get the channels.
-    channels = get_channels(exrimg, outchans=outchans)
-    # Compose image data into what is necessary for output.
-    outimg = np.dstack(channels)
+def fix_and_normalize(outimg, outchans, normchans, nanfill):
+    """ Replace nans and infs in 'outimg' (height x width x channels,
+    named by 'outchans') with 'nanfill', and normalize 'normchans'.
+    Modifies 'outimg' in place and returns it."""
+    import numpy as np
     # Fix nans and infs.
     badidx = ~np.isfinite(outimg)
     if np.any(badidx):
@@ -71,15 +67,30 @@ def convert(inname, outname, outchans, normchans, nanfill):
         # Reset any nanfill values that were changed by normalizing.
         # what was specified.
         outimg[badidx] = nanfill
+    return outimg
+
+
+def convert(inname, outname, outchans, normchans, nanfill):
+    """ Convert one file."""
+    import numpy as np
+    from scipy.misc import imsave
+    # Load the .exr file.
+    exrimg = load_exr(inname)
+    # Get the channels.
+    channels = get_channels(exrimg, outchans=outchans)
+    # Compose image data into what is necessary for output.
+    outimg = np.dstack(channels)
+    # Fix nans and infs, and normalize (optionally).
+    fix_and_normalize(outimg, outchans, normchans, nanfill)
     # Squeeze out length-1 dimensions.
     outimg = np.squeeze(outimg)
     # Write output file.
     imsave(outname, outimg)
 
 
-if __name__ == "__main__":
-    # Parse input arguments.
-
+def main(argv=None):
+    """ Parse command line arguments 'argv' (defaults to sys.argv),
+    convert the files and return an exit code."""
     ## Cmd line interface.
     # Create parser object.
     parser = ArgumentParser(description="Output options.")
@@ -121,7 +132,7 @@ if __name__ == "__main__":
     parser.add_argument("--force", action="store_true",
                         help="Allow output files to overwrite existing ones.")
     # Create parser and parse args.
-    parsed = parser.parse_args()
+    parsed = parser.parse_args(argv)
     innames = reduce(add, [sorted(glob.glob(fn)) for fn in parsed.innames])
     outname = parsed.outname
     suffix = parsed.suffix
@@ -133,8 +144,9 @@ if __name__ == "__main__":
     # Set parameters according to inputs.
     N = len(innames)
     if N == 0:
-        raise IOError("Cannot find input files that match: %s" %
-                      ", ".join(parsed.innames))
+        print("Cannot find input files that match: %s" %
+              ", ".join(parsed.innames), file=sys.stderr)
+        return 1
     # Output format.
     if outfmt is None:
         # If no outfmt was input, try getting it from the outname.
@@ -159,13 +171,23 @@ if __name__ == "__main__":
                 on = nametemplate1 % outname
             else:
                 on = nametemplateN % (outname, i)
-        # Raise error if: we try to overwrite the input file; we try
+        # Fail if: we try to overwrite the input file; we try
         # to overwrite an existing file and haven't input 'force'.
         if inname == on or not force and os.path.isfile(on):
-            raise IOError("Attempted to overwrite: %s" % on)
+            print("Attempted to overwrite: %s" % on, file=sys.stderr)
+            return 1
         # Store output file name.
         outnames.append(on)
     # Run the converter over all files.
     for inname, outname in zip(innames, outnames):
         # Do the conversion.
-        convert(inname, outname, outchans, normchans, nanfill)
+        try:
+            convert(inname, outname, outchans, normchans, nanfill)
+        except Exception as err:
+            print("Failed to convert %s: %s" % (inname, err), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
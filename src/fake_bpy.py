@@ -0,0 +1,378 @@
+""" In-process fake bpy, bmesh and mathutils modules.
+
+Implements just enough of Blender's Python API to run render_runner
+(with render_hooks), estimate_mass and demo/create_scenes outside
+Blender. Operator calls and data writes are recorded in a Recorder.
+
+Usage:
+  import fake_bpy
+  recorder = fake_bpy.install()   # Before importing the scripts.
+  import render_runner
+"""
+import random
+import sys
+import traceback
+import types
+
+
+class Recorder(object):
+    """ Records operator calls and data writes."""
+
+    def __init__(self):
+        self.enabled = True
+        self.clear()
+
+    def clear(self):
+        """ Forget all recorded calls and writes."""
+        self.ops = []
+        self.writes = []
+
+    def op(self, name, kwargs):
+        if self.enabled:
+            self.ops.append((name, kwargs))
+
+    def write(self, owner, attr, value):
+        if self.enabled:
+            self.writes.append((owner, attr, value))
+
+
+recorder = Recorder()
+
+
+class Struct(object):
+    """ Attribute bag whose attribute writes are recorded."""
+
+    def __init__(self, **attrs):
+        for k, v in attrs.items():
+            object.__setattr__(self, k, v)
+
+    def __setattr__(self, attr, value):
+        recorder.write(type(self).__name__, attr, value)
+        object.__setattr__(self, attr, value)
+
+
+class Collection(list):
+    """ List that can also be indexed by item name."""
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for item in self:
+                if item.name == key:
+                    return item
+            raise KeyError(key)
+        return list.__getitem__(self, key)
+
+    def new(self, name):
+        item = Struct(name=name)
+        self.append(item)
+        return item
+
+
+## mathutils
+
+class Vector(list):
+    """ Minimal mathutils.Vector."""
+    x = property(lambda self: self[0],
+                 lambda self, v: self.__setitem__(0, v))
+    y = property(lambda self: self[1],
+                 lambda self, v: self.__setitem__(1, v))
+    z = property(lambda self: self[2],
+                 lambda self, v: self.__setitem__(2, v))
+
+    def __add__(self, other):
+        return Vector(a + b for a, b in zip(self, other))
+
+    def __sub__(self, other):
+        return Vector(a - b for a, b in zip(self, other))
+
+    def __truediv__(self, s):
+        return Vector(a / s for a in self)
+
+
+class Matrix(list):
+    """ Minimal mathutils.Matrix (4x4 identity by default)."""
+
+    def __init__(self, rows=None):
+        if rows is None:
+            rows = [[float(i == j) for j in range(4)] for i in range(4)]
+        list.__init__(self, [list(r) for r in rows])
+        self.translation = Vector([0., 0., 0.])
+
+    def __mul__(self, vec):
+        v = list(vec) + [1.]
+        return Vector(sum(a * b for a, b in zip(row, v))
+                      for row in self[:3])
+
+
+## bpy data
+
+class Vertex(object):
+    __slots__ = ("co",)
+
+    def __init__(self, co):
+        self.co = co
+
+
+class Particle(object):
+    __slots__ = ("location",)
+
+    def __init__(self, location):
+        self.location = location
+
+
+# Particles are expensive to make, so they are shared between systems
+# with the same (count, seed).
+_particles = {}
+
+
+def make_particles(count, seed):
+    """ Return 'count' particles uniformly distributed in the unit
+    cube."""
+    key = (count, seed)
+    if key not in _particles:
+        rnd = random.Random(seed).random
+        _particles[key] = [Particle((rnd(), rnd(), rnd()))
+                           for _ in range(count)]
+    return _particles[key]
+
+
+class ParticleSystem(Struct):
+
+    def __init__(self):
+        Struct.__init__(self, seed=0, settings=Struct(count=1000))
+
+    @property
+    def particles(self):
+        return make_particles(self.settings.count, self.seed)
+
+
+class Mesh(Struct):
+
+    def __init__(self, verts=()):
+        Struct.__init__(self, vertices=[Vertex(Vector(v)) for v in verts],
+                        materials=[])
+
+
+class Object(Struct):
+
+    def __init__(self, name, data=None):
+        Struct.__init__(self, name=name, data=data or Mesh(), type="MESH",
+                        particle_systems=[], rotation_mode="XYZ",
+                        select=False, matrix_world=Matrix(),
+                        location=Vector([0., 0., 0.]),
+                        scale=Vector([1., 1., 1.]))
+
+
+class Objects(Collection):
+    """ Scene objects, with an active object."""
+    active = None
+
+
+class Node(Struct):
+
+    def __init__(self, type, outputs=(), inputs=()):
+        Struct.__init__(self, type=type,
+                        outputs=dict((n, Struct(name=n)) for n in outputs),
+                        inputs=dict((n, Struct(name=n)) for n in inputs))
+
+
+class Nodes(Collection):
+    """ Compositor nodes, with an active node."""
+    active = None
+    # Node type and sockets, by bl_idname.
+    kinds = {
+        "CompositorNodeRLayers": ("R_LAYERS", ("Image", "Alpha", "Z"), ()),
+        "CompositorNodeViewer": ("VIEWER", (), ("Image", "Alpha", "Z")),
+        "CompositorNodeComposite": ("COMPOSITE", (), ("Image", "Alpha",
+                                                      "Z")),
+        "CompositorNodeBlur": ("BLUR", ("Image",), ("Image", "Size")),
+    }
+
+    def new(self, bl_idname):
+        node = Node(*self.kinds[bl_idname])
+        self.append(node)
+        return node
+
+    def remove(self, node):
+        list.remove(self, node)
+        if self.active is node:
+            self.active = None
+
+
+class Links(list):
+
+    def new(self, output, input):
+        self.append((output, input))
+        return self[-1]
+
+
+class Scene(Struct):
+
+    def __init__(self, name):
+        Struct.__init__(
+            self, name=name, frame_start=1, frame_end=250, frame_current=1,
+            objects=Objects(), use_nodes=False,
+            node_tree=Struct(nodes=Nodes(), links=Links()),
+            cycles=Struct(device="CPU", samples=10),
+            render=Struct(filepath="//", threads_mode="AUTO", threads=1,
+                          tile_x=64, tile_y=64, use_border=False,
+                          use_crop_to_border=False, use_compositing=False,
+                          layers=Struct(active=Struct(use_pass_z=False))))
+
+    def update(self):
+        recorder.op("scene.update", {})
+
+
+class SystemPrefs(Struct):
+    """ user_preferences.system, with the compute device enums."""
+    inventory = {"NONE": ["CPU"], "CUDA": [], "OPENCL": []}
+
+    def __init__(self):
+        Struct.__init__(self, compute_device_type="NONE")
+        props = {
+            "compute_device_type": Struct(enum_items=Struct(
+                keys=lambda: list(self.inventory))),
+            "compute_device": Struct(enum_items=Struct(
+                keys=lambda: list(self.inventory[self.compute_device_type]))),
+        }
+        object.__setattr__(self, "bl_rna", Struct(properties=props))
+
+    @property
+    def compute_device(self):
+        return (self.inventory[self.compute_device_type] or ["CPU"])[0]
+
+
+class Context(Struct):
+
+    @property
+    def scene(self):
+        return self.screen.scene
+
+    @property
+    def selected_objects(self):
+        return [o for o in self.scene.objects if o.select]
+
+
+## bpy.ops
+
+# Operator implementations, by "group.name". Unregistered operators
+# are only recorded.
+OPERATORS = {}
+
+
+def operator(name):
+    """ Decorator that registers a fake operator implementation."""
+    def decorator(func):
+        OPERATORS[name] = func
+        return func
+    return decorator
+
+
+class OpsGroup(object):
+
+    def __init__(self, group):
+        self._group = group
+
+    def __getattr__(self, name):
+        opname = "{}.{}".format(self._group, name)
+        func = OPERATORS.get(opname)
+
+        def call(*args, **kwargs):
+            recorder.op(opname, kwargs)
+            if func is not None:
+                func(**kwargs)
+            return {"FINISHED"}
+        return call
+
+
+class Ops(object):
+
+    def __getattr__(self, group):
+        return OpsGroup(group)
+
+
+@operator("mesh.primitive_circle_add")
+def primitive_circle_add(vertices=32, **kwargs):
+    scene = bpy.context.scene
+    obj = Object("Circle", Mesh([(0., 0., 0.)] * vertices))
+    scene.objects.append(obj)
+    scene.objects.active = obj
+
+
+@operator("object.material_slot_add")
+def material_slot_add(**kwargs):
+    bpy.context.scene.objects.active.data.materials.append(None)
+
+
+@operator("object.particle_system_add")
+def particle_system_add(**kwargs):
+    bpy.context.scene.objects.active.particle_systems.append(
+        ParticleSystem())
+
+
+@operator("object.particle_system_remove")
+def particle_system_remove(**kwargs):
+    bpy.context.scene.objects.active.particle_systems.pop()
+
+
+@operator("render.render")
+def render(animation=False, scene=None, **kwargs):
+    """ Run the render_post handlers after each frame, printing their
+    errors like Blender does."""
+    scene = bpy.data.scenes[scene] if scene else bpy.context.scene
+    if animation:
+        frames = range(scene.frame_start, scene.frame_end + 1)
+    else:
+        frames = [scene.frame_current]
+    for frame in frames:
+        scene.frame_current = frame
+        for handler in list(bpy.app.handlers.render_post):
+            try:
+                handler(scene)
+            except Exception:
+                # Blender prints handler errors and carries on.
+                traceback.print_exc()
+
+
+## Modules
+
+def new_scenes(n, prefix="Scene"):
+    """ Replace bpy.data.scenes with 'n' new scenes and make the first
+    one current."""
+    scenes = Collection(Scene("{}.{:03d}".format(prefix, i))
+                        for i in range(n))
+    bpy.data.scenes = scenes
+    bpy.context.screen.scene = scenes[0]
+    return scenes
+
+
+def reset():
+    """ Reset bpy's data and the recorder."""
+    bpy.data = Struct(scenes=Collection(), filepath="/tmp/fake.blend",
+                      materials=Collection([Struct(name="Stone")]),
+                      images=Collection())
+    bpy.context = Context(screen=Struct(scene=None),
+                          user_preferences=Struct(system=SystemPrefs()))
+    new_scenes(1)
+    recorder.clear()
+
+
+bpy = types.ModuleType("bpy")
+bpy.ops = Ops()
+bpy.app = Struct(version_string="fake", handlers=Struct(render_post=[]))
+bpy.path = Struct(abspath=lambda p: p)
+bmesh = types.ModuleType("bmesh")
+bmesh.new = lambda: Struct()
+bmesh.ops = Ops()
+mathutils = types.ModuleType("mathutils")
+mathutils.Vector = Vector
+mathutils.Matrix = Matrix
+reset()
+
+
+def install():
+    """ Put the fake modules in sys.modules and return the recorder."""
+    sys.modules["bpy"] = bpy
+    sys.modules["bmesh"] = bmesh
+    sys.modules["mathutils"] = mathutils
+    return recorder
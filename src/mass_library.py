@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+""" Estimates mass properties of a whole library of meshes by sampling
+points in their volumes, in parallel worker processes.
+
+The vertex and triangle arrays of every mesh are put once into
+multiprocessing.shared_memory blocks, and the workers sample on
+zero-copy views of them. A point is inside a mesh if a ray from it in
++z crosses the mesh's triangles an odd number of times, so meshes must
+be closed (open or empty ones give NaNs). Each mesh's triangles are
+binned into an xy grid, so each point is only tested against the
+triangles in its cell. No Blender (or particle system) is needed;
+export a library from Blender with estimate_mass.save_library.
+
+Example:
+  python mass_library.py library.npz -n 5000 -o com_moi.json
+"""
+# Standard
+from argparse import ArgumentParser
+import json
+import multiprocessing
+import sys
+# External
+import numpy as np
+
+
+# Points sampled per batch, per object.
+BATCH = 20000
+# Give up on an object (e.g. a very thin one, which few samples hit)
+# after this many batches.
+MAX_BATCHES = 100
+
+
+def pack_library(meshes):
+    """ Concatenate a list of (verts, tris) arrays into (verts, tris,
+    vert_offsets, tri_offsets). Object i's rows are
+    [offsets[i]:offsets[i + 1]], and its triangles index its own
+    vertices."""
+    vert_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+    tri_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+    vert_offsets[1:] = np.cumsum([len(v) for v, t in meshes])
+    tri_offsets[1:] = np.cumsum([len(t) for v, t in meshes])
+    verts = np.empty((vert_offsets[-1], 3), dtype=np.float64)
+    tris = np.empty((tri_offsets[-1], 3), dtype=np.int64)
+    for i, (v, t) in enumerate(meshes):
+        verts[vert_offsets[i]:vert_offsets[i + 1]] = v
+        tris[tri_offsets[i]:tri_offsets[i + 1]] = t
+    return verts, tris, vert_offsets, tri_offsets
+
+
+def is_closed(tris):
+    """ Return whether the triangles form a closed (edge-manifold) mesh:
+    every edge is shared by exactly two triangles. Ray parity is only
+    meaningful for closed meshes."""
+    if len(tris) == 0:
+        return False
+    edges = np.sort(np.concatenate([tris[:, [0, 1]], tris[:, [1, 2]],
+                                    tris[:, [2, 0]]]), axis=1)
+    counts = np.unique(edges, axis=0, return_counts=True)[1]
+    return bool(np.all(counts == 2))
+
+
+def grid_index(tri_xy, lo, hi, size=None):
+    """ Bin triangles (m x 3 x 2 xy coordinates) into a size x size grid
+    over [lo, hi]. Returns (size, cell_starts, tri_ids): the triangles
+    overlapping cell c are tri_ids[cell_starts[c]:cell_starts[c + 1]]."""
+    m = len(tri_xy)
+    if size is None:
+        size = int(np.clip(np.sqrt(m) / 2, 1, 64))
+    scale = size / np.maximum(hi - lo, 1e-12)
+    # Range of cells overlapped by each triangle's bounding box.
+    c0 = np.clip(((tri_xy.min(axis=1) - lo) * scale).astype(np.int64),
+                 0, size - 1)
+    c1 = np.clip(((tri_xy.max(axis=1) - lo) * scale).astype(np.int64),
+                 0, size - 1)
+    nx = c1[:, 0] - c0[:, 0] + 1
+    n = nx * (c1[:, 1] - c0[:, 1] + 1)
+    # Expand to one (cell, triangle) pair per overlapped cell.
+    tri = np.repeat(np.arange(m), n)
+    k = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    nxr = np.repeat(nx, n)
+    cx = np.repeat(c0[:, 0], n) + k % nxr
+    cy = np.repeat(c0[:, 1], n) + k // nxr
+    cell = cy * size + cx
+    order = np.argsort(cell, kind="mergesort")
+    cell_starts = np.searchsorted(cell[order], np.arange(size * size + 1))
+    return size, cell_starts, tri[order]
+
+
+def crossings(points, tri_pts):
+    """ Return the number of triangles (m x 3 x 3) that a +z ray from
+    each point (k x 3) crosses."""
+    a, b, c = tri_pts[:, 0], tri_pts[:, 1], tri_pts[:, 2]
+    px = points[:, None, 0]
+    py = points[:, None, 1]
+    # Barycentric coordinates of the points in the triangles' xy
+    # projections. Vertical triangles (d == 0) are never crossed.
+    d = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - \
+        (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w0 = ((b[:, 0] - px) * (c[:, 1] - py) -
+              (b[:, 1] - py) * (c[:, 0] - px)) / d
+        w1 = ((c[:, 0] - px) * (a[:, 1] - py) -
+              (c[:, 1] - py) * (a[:, 0] - px)) / d
+        w2 = 1. - w0 - w1
+        inside = (w0 >= 0) & (w1 >= 0) & (w2 >= 0)
+        z = w0 * a[:, 2] + w1 * b[:, 2] + w2 * c[:, 2]
+    return np.count_nonzero(inside & (z > points[:, None, 2]), axis=1)
+
+
+def contains(points, tri_pts, index, lo, hi):
+    """ Return a bool array indicating which points are inside the
+    closed mesh with triangles 'tri_pts' and grid 'index'."""
+    size, cell_starts, tri_ids = index
+    scale = size / np.maximum(hi - lo, 1e-12)
+    cxy = np.clip(((points[:, :2] - lo) * scale).astype(np.int64),
+                  0, size - 1)
+    cell = cxy[:, 1] * size + cxy[:, 0]
+    count = np.zeros(len(points), dtype=np.int64)
+    # Test the points in each cell against that cell's triangles.
+    order = np.argsort(cell, kind="mergesort")
+    starts = np.searchsorted(cell[order], np.arange(size * size + 1))
+    for c in np.flatnonzero(np.diff(starts)):
+        ids = tri_ids[cell_starts[c]:cell_starts[c + 1]]
+        if len(ids):
+            pidx = order[starts[c]:starts[c + 1]]
+            count[pidx] = crossings(points[pidx], tri_pts[ids])
+    return count % 2 == 1
+
+
+def com_moi(verts, tris, count=5000, seed=0, batch=BATCH,
+            max_batches=MAX_BATCHES):
+    """ Get center-of-mass and moments of inertia of one closed mesh
+    from 'count' uniform samples of its volume, like
+    estimate_mass.get_com_moi. Returns NaNs for empty or open meshes."""
+    nan = [float("nan")] * 3
+    if len(verts) == 0 or not is_closed(tris):
+        return nan, nan
+    tri_pts = verts[tris]
+    lo, hi = verts.min(axis=0), verts.max(axis=0)
+    index = grid_index(tri_pts[:, :, :2], lo[:2], hi[:2])
+    rng = np.random.RandomState(seed)
+    pos = []
+    n = 0
+    for _ in range(max_batches):
+        points = lo + (hi - lo) * rng.random_sample((batch, 3))
+        inside = points[contains(points, tri_pts, index, lo[:2], hi[:2])]
+        pos.append(inside)
+        n += len(inside)
+        if n >= count:
+            break
+    pos = np.concatenate(pos)[:count]
+    if len(pos) == 0:
+        return nan, nan
+    # Calculate center of mass of points.
+    com = pos.mean(axis=0)
+    p2 = (pos - com) ** 2
+    # Calculate moments of inertia.
+    moi = [(p2[:, 1] + p2[:, 2]).mean(),
+           (p2[:, 0] + p2[:, 2]).mean(),
+           (p2[:, 0] + p2[:, 1]).mean()]
+    return com.tolist(), [float(m) for m in moi]
+
+
+# Worker process state, set by _init_worker().
+_worker = {}
+
+
+def _init_worker(names, shapes, vert_offsets, tri_offsets, count, seed):
+    """ Attach to the library's shared memory blocks."""
+    from multiprocessing import shared_memory
+    shms = [shared_memory.SharedMemory(name=name) for name in names]
+    _worker["shms"] = shms
+    _worker["verts"] = np.ndarray(shapes[0], dtype=np.float64,
+                                  buffer=shms[0].buf)
+    _worker["tris"] = np.ndarray(shapes[1], dtype=np.int64,
+                                 buffer=shms[1].buf)
+    _worker["vert_offsets"] = vert_offsets
+    _worker["tri_offsets"] = tri_offsets
+    _worker["count"] = count
+    _worker["seed"] = seed
+
+
+def _worker_com_moi(i):
+    """ Sample object i on views of the shared arrays."""
+    vo, to = _worker["vert_offsets"], _worker["tri_offsets"]
+    verts = _worker["verts"][vo[i]:vo[i + 1]]
+    tris = _worker["tris"][to[i]:to[i + 1]]
+    com, moi = com_moi(verts, tris, count=_worker["count"],
+                       seed=_worker["seed"] + i)
+    return i, com, moi
+
+
+def iter_com_moi(meshes, count=5000, seed=0, processes=None):
+    """ Yield (index, com, moi) for each (verts, tris) in 'meshes', in
+    the order they finish, using all cores by default."""
+    from multiprocessing import shared_memory
+    verts, tris, vert_offsets, tri_offsets = pack_library(meshes)
+    shms = []
+    try:
+        # Copy the library into shared memory once.
+        for arr in (verts, tris):
+            shm = shared_memory.SharedMemory(create=True,
+                                             size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            shms.append(shm)
+        del verts, tris
+        initargs = ([shm.name for shm in shms],
+                    [(vert_offsets[-1], 3), (tri_offsets[-1], 3)],
+                    vert_offsets, tri_offsets, count, seed)
+        pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                    initargs=initargs)
+        try:
+            for result in pool.imap_unordered(_worker_com_moi,
+                                              range(len(meshes))):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def load_library(filename):
+    """ Load a library saved by estimate_mass.save_library. Returns
+    (names, meshes)."""
+    data = np.load(filename)
+    # Each data[...] reads the whole array from the file, so read them
+    # once.
+    names = [str(n) for n in data["names"]]
+    verts, tris = data["verts"], data["tris"]
+    vo, to = data["vert_offsets"], data["tri_offsets"]
+    meshes = [(verts[vo[i]:vo[i + 1]], tris[to[i]:to[i + 1]])
+              for i in range(len(names))]
+    return names, meshes
+
+
+if __name__ == "__main__":
+    ## Cmd line interface.
+    parser = ArgumentParser(description=__doc__)
+    # Argument: library file.
+    parser.add_argument("library", help="Library .npz file.")
+    # Argument: number of samples.
+    parser.add_argument("--count", "-n", type=int, default=5000,
+                        help="Samples per object.")
+    # Argument: random seed.
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    # Argument: number of processes.
+    parser.add_argument("--processes", "-p", type=int, default=None,
+                        help="Number of worker processes. Defaults to cores.")
+    # Argument: output file name.
+    parser.add_argument("-o", dest="outname", default=None,
+                        help="Output .json file. Defaults to stdout.")
+    parsed = parser.parse_args()
+    names, meshes = load_library(parsed.library)
+    results = {}
+    for i, com, moi in iter_com_moi(meshes, count=parsed.count,
+                                    seed=parsed.seed,
+                                    processes=parsed.processes):
+        results[names[i]] = {"com": com, "moi": moi}
+    if parsed.outname:
+        with open(parsed.outname, "w") as fid:
+            json.dump(results, fid, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
@@ -1,21 +1,20 @@
 """ Prints Cycles device."""
-import bpy
-from pdb import set_trace as BP
+import os
+import sys
+# Blender doesn't put the script's directory on the path.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cycles_device import get_devices
 
 
 if __name__ == "__main__":
-    # Print device settings.
-    bcups = bpy.context.user_preferences.system
-    bcupsbp = bcups.bl_rna.properties
-    current_device_type = bcups.compute_device_type
-    device_types = bcupsbp['compute_device_type'].enum_items.keys()
-    devices = {}
+    # Print device settings. Pass "--refresh" after "--" to re-probe
+    # instead of using the cached inventory.
+    try:
+        args = sys.argv[sys.argv.index("--") + 1:]
+    except ValueError:
+        args = []
+    refresh = "--refresh" in args
+    devices = get_devices(refresh=refresh)
     print('Devices:')
-    for dt in device_types:
-        bcups.compute_device_type = dt
-        devices[dt] = bcupsbp['compute_device'].enum_items.keys()
+    for dt in sorted(devices):
         print('  {}: {}'.format(dt, ', '.join(devices[dt])))
-    bcups.compute_device_type = current_device_type
-    # print(bcups.compute_device_type, bcups.compute_device)
-    # print(bpy.context.scene.cycles.device)
-
@@ -0,0 +1,303 @@
+""" Post-render hook pipeline.
+
+After each rendered frame, the pixels are read from the compositor's
+Viewer buffer as a NumPy array (no disk round-trip), run through
+registered transforms and written to the requested formats from a
+background thread. bpy operators hold the GIL, so the writer mostly
+runs between operator calls rather than truly alongside the render; at
+most a few frames are queued, after which the next frame waits.
+
+Transforms are given as "name" or "name:arg", e.g.:
+  depth  nanfill:0  normalize:Z  normalize:RGB,5  downsample:2
+
+Only the "npy" writer works with Blender's bundled Python; "exr" needs
+the OpenEXR module and other image formats need scipy.misc.imsave
+(SciPy < 1.2) installed into it.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+try:
+    import bpy
+except ImportError:
+    bpy = None
+from exrtoimg import fix_and_normalize
+
+
+# Registered transforms and writers, by name.
+TRANSFORMS = {}
+WRITERS = {}
+
+
+def register_transform(name):
+    """ Decorator that registers a transform. A transform is called as
+    f(img, chans, arg) with an image array (height x width x channels,
+    named by the string 'chans') and returns the new (img, chans)."""
+    def decorator(func):
+        TRANSFORMS[name] = func
+        return func
+    return decorator
+
+
+def register_writer(fmt):
+    """ Decorator that registers a writer for file format 'fmt'. A
+    writer is called as f(filename, img, chans)."""
+    def decorator(func):
+        WRITERS[fmt] = func
+        return func
+    return decorator
+
+
+@register_transform("depth")
+def depth(img, chans, arg=None):
+    """ Keep only the depth channel. The Viewer is linked to the Z pass
+    when this transform is used, so every color channel holds Z."""
+    return img[:, :, :1], "Z"
+
+
+@register_transform("normalize")
+def normalize(img, chans, arg="RGBAZ"):
+    """ Replace nans and infs and normalize channels, in one step like
+    exrtoimg.convert. 'arg' is "NORMCHANS[,NANFILL]" (NANFILL defaults
+    to 0, as in exrtoimg)."""
+    normchans, _, fill = arg.partition(",")
+    return fix_and_normalize(img, chans, normchans, float(fill or 0)), chans
+
+
+@register_transform("nanfill")
+def nanfill(img, chans, arg="0"):
+    """ Replace nans and infs with 'arg' without normalizing. Same as
+    "normalize:,<arg>"."""
+    return normalize(img, chans, "," + arg)
+
+
+@register_transform("downsample")
+def downsample(img, chans, arg="2"):
+    """ Downsample by an integer factor 'arg', averaging blocks."""
+    f = int(arg)
+    h, w, c = img.shape
+    h, w = h // f * f, w // f * f
+    img = img[:h, :w].reshape(h // f, f, w // f, f, c).mean(axis=(1, 3))
+    return img, chans
+
+
+@register_writer("npy")
+def write_npy(filename, img, chans):
+    """ Write a .npy file."""
+    import numpy as np
+    np.save(filename, img)
+
+
+@register_writer("exr")
+def write_exr(filename, img, chans):
+    """ Write a float .exr file."""
+    import Imath
+    import OpenEXR
+    import numpy as np
+    h, w = img.shape[:2]
+    header = OpenEXR.Header(w, h)
+    flt = Imath.Channel(Imath.PixelType(Imath.PixelType.FLOAT))
+    header["channels"] = dict((c, flt) for c in chans)
+    exrout = OpenEXR.OutputFile(filename, header)
+    exrout.writePixels(dict(
+        (c, np.ascontiguousarray(img[:, :, i], dtype=np.float32).tobytes())
+        for i, c in enumerate(chans)))
+    exrout.close()
+
+
+def write_image(filename, img, chans):
+    """ Write an 8-bit image, in the format given by the extension."""
+    import numpy as np
+    from scipy.misc import imsave
+    imsave(filename, np.squeeze(img))
+
+
+def parse_transform(spec):
+    """ Parse "name" or "name:arg" into (name, function, arg)."""
+    name, _, arg = spec.partition(":")
+    if name not in TRANSFORMS:
+        raise ValueError("Unknown transform: %s (choose from %s)" %
+                         (name, ", ".join(sorted(TRANSFORMS))))
+    return name, TRANSFORMS[name], arg or None
+
+
+# Compositor node types that leave the render as it is.
+PASS_THROUGH_NODES = ("R_LAYERS", "COMPOSITE", "VIEWER")
+
+
+def compositor_settings(scene):
+    """ Return the settings of 'scene' that ensure_viewer changes, for
+    restore_compositor."""
+    return (scene.use_nodes, scene.render.use_compositing,
+            scene.render.layers.active.use_pass_z)
+
+
+def restore_compositor(scene, settings, nodes=(), links=(), active=None):
+    """ Remove the 'nodes' and 'links' added by ensure_viewer, make
+    'active' the active node again and restore settings returned by
+    compositor_settings."""
+    tree = scene.node_tree
+    for link in links:
+        tree.links.remove(link)
+    for node in nodes:
+        tree.nodes.remove(node)
+    if active is not None:
+        tree.nodes.active = active
+    (scene.use_nodes, scene.render.use_compositing,
+     scene.render.layers.active.use_pass_z) = settings
+
+
+def ensure_viewer(scene, depth=False):
+    """ Set up 'scene's compositor so a new Viewer shows the render
+    layer's image (or Z pass, if 'depth'), and return the (nodes, links,
+    active node) to pass to restore_compositor. The Viewer is only
+    filled when compositing, so if compositing is off it is turned on;
+    raises ValueError if the node tree would then change the render."""
+    tree = scene.node_tree
+    compositing = scene.use_nodes and scene.render.use_compositing
+    if not compositing and tree is not None and \
+            any(n.type not in PASS_THROUGH_NODES for n in tree.nodes):
+        raise ValueError(
+            "Compositing is off for scene {}, but reading pixels needs it "
+            "and its node tree would change the render. Turn compositing "
+            "on or remove the tree.".format(scene.name))
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    nodes = []
+    links = []
+    # Find (or add) the render layers node.
+    rlayers = [n for n in tree.nodes if n.type == "R_LAYERS"]
+    if rlayers:
+        rlayer = rlayers[0]
+    else:
+        rlayer = tree.nodes.new("CompositorNodeRLayers")
+        nodes.append(rlayer)
+    if not compositing and \
+            not any(n.type == "COMPOSITE" for n in tree.nodes):
+        # Pass the render through unchanged.
+        composite = tree.nodes.new("CompositorNodeComposite")
+        nodes.append(composite)
+        links.append(tree.links.new(rlayer.outputs["Image"],
+                                    composite.inputs["Image"]))
+    # Add a Viewer of our own, so existing ones keep their inputs.
+    viewer = tree.nodes.new("CompositorNodeViewer")
+    nodes.append(viewer)
+    viewer.use_alpha = True
+    if depth:
+        scene.render.layers.active.use_pass_z = True
+        # The socket is called "Depth" in newer Blenders.
+        name = "Z" if "Z" in rlayer.outputs else "Depth"
+    else:
+        name = "Image"
+    links.append(tree.links.new(rlayer.outputs[name],
+                                viewer.inputs["Image"]))
+    active = tree.nodes.active
+    tree.nodes.active = viewer
+    return nodes, links, active
+
+
+def viewer_pixels(image_name="Viewer Node"):
+    """ Return the Viewer buffer as a float32 array (height x width x
+    channels), top row first."""
+    import numpy as np
+    image = bpy.data.images[image_name]
+    w, h = image.size
+    pixels = np.empty(w * h * image.channels, dtype=np.float32)
+    try:
+        # Fast path, without building a Python list of floats.
+        image.pixels.foreach_get(pixels)
+    except AttributeError:
+        pixels[:] = image.pixels[:]
+    # Blender stores the bottom row first.
+    return pixels.reshape(h, w, image.channels)[::-1]
+
+
+class PostRender(object):
+    """ Reads, transforms and writes each rendered frame. The output
+    name is the scene's render path plus SUFFIX (after the frame number,
+    if 'animation'), so it never overwrites Blender's own output."""
+
+    SUFFIX = "_post"
+
+    def __init__(self, transforms=(), formats=("npy",), animation=False,
+                 workers=1, max_pending=2):
+        self.transforms = [parse_transform(t) for t in transforms]
+        names = [name for name, f, a in self.transforms]
+        if "nanfill" in names and "normalize" in names:
+            # Normalizing after filling would rescale the fill value.
+            raise ValueError("Use normalize:CHANS,NANFILL instead of "
+                             "nanfill and normalize together.")
+        self.depth = any(name == "depth" for name, f, a in self.transforms)
+        self.formats = tuple(formats)
+        self.animation = animation
+        # (scene, settings, nodes, links, active) for each scene set up,
+        # to restore.
+        self.saved = []
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.futures = []
+        # The first error from a write, re-raised by close().
+        self.error = None
+
+    def setup(self, scene):
+        """ Prepare 'scene's compositor for reading pixels."""
+        settings = compositor_settings(scene)
+        added = ensure_viewer(scene, depth=self.depth)
+        self.saved.append((scene, settings) + added)
+
+    def register(self):
+        """ Run after every rendered frame."""
+        bpy.app.handlers.render_post.append(self.handler)
+
+    def unregister(self):
+        """ Stop running after every rendered frame and restore the
+        compositor settings changed by setup."""
+        if self.handler in bpy.app.handlers.render_post:
+            bpy.app.handlers.render_post.remove(self.handler)
+        while self.saved:
+            restore_compositor(*self.saved.pop())
+
+    def handler(self, scene, *args):
+        """ bpy.app.handlers.render_post callback."""
+        # Output name: the render path (plus frame number, like
+        # Blender's animation frames) and the suffix.
+        basename = bpy.path.abspath(scene.render.filepath)
+        if self.animation:
+            basename += "{:04d}".format(scene.frame_current)
+        basename += self.SUFFIX
+        # Read the pixels now (bpy isn't thread safe), finish later.
+        img = viewer_pixels().copy()
+        # Bound the number of frames held in memory. Errors aren't raised
+        # here: Blender would print and drop them.
+        self.collect()
+        while len(self.futures) >= self.max_pending:
+            wait(self.futures, return_when=FIRST_COMPLETED)
+            self.collect()
+        self.futures.append(
+            self.executor.submit(self.finish, img, "RGBA", basename))
+
+    def finish(self, img, chans, basename):
+        """ Apply the transforms and write the formats."""
+        for name, func, arg in self.transforms:
+            if arg is None:
+                img, chans = func(img, chans)
+            else:
+                img, chans = func(img, chans, arg)
+        for fmt in self.formats:
+            writer = WRITERS.get(fmt, write_image)
+            writer("{}.{}".format(basename, fmt), img, chans)
+
+    def collect(self):
+        """ Forget the finished writes, keeping the first error."""
+        for future in [f for f in self.futures if f.done()]:
+            self.futures.remove(future)
+            if self.error is None:
+                self.error = future.exception()
+
+    def close(self):
+        """ Stop running after frames, wait for the pending writes and
+        re-raise the first error from them."""
+        self.unregister()
+        self.executor.shutdown(wait=True)
+        self.collect()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+""" Renders one large frame as N horizontal border/crop regions in
+parallel Blender processes (through render_runner.py) and stitches the
+EXR tiles back together.
+
+Example:
+  python render_regions.py scene.blend -f 1 -n 8 -o frame.exr -- --samples 500
+"""
+# Standard
+from argparse import ArgumentParser
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+# External: Imath and OpenEXR are imported in stitch().
+from exrtoimg import get_channels, get_exr_dims, load_exr
+
+
+RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      "render_runner.py")
+
+
+def regions(n):
+    """ Split the frame into 'n' full-width horizontal strips. Returns
+    (min_x, max_x, min_y, max_y) fractions, top strip first."""
+    edges = [float(i) / n for i in range(n + 1)]
+    # Blender's y axis points up, so the top strip has the largest y.
+    return [(0., 1., edges[i], edges[i + 1]) for i in reversed(range(n))]
+
+
+def region_commands(blendfile, frame, tilenames, blender="blender",
+                    threads=None, args=()):
+    """ Return the Blender command line for each region's tile."""
+    n = len(tilenames)
+    if threads is None:
+        # Share the cores between the processes.
+        threads = max(1, multiprocessing.cpu_count() // n)
+    cmds = []
+    for border, tilename in zip(regions(n), tilenames):
+        cmd = [blender, "-b", blendfile, "-t", str(threads),
+               "--python", RUNNER, "--",
+               "--render-frame", str(frame),
+               "--render-output", tilename,
+               "--border"] + [repr(b) for b in border] + \
+              ["--no-tuning", "--no-kill"] + list(args)
+        cmds.append(cmd)
+    return cmds
+
+
+def render_regions(cmds):
+    """ Run the region commands in parallel and raise an error if any
+    of them fail."""
+    procs = [subprocess.Popen(cmd) for cmd in cmds]
+    codes = [p.wait() for p in procs]
+    failed = [i for i, code in enumerate(codes) if code]
+    if failed:
+        raise RuntimeError("Region render(s) failed: %s" %
+                           ", ".join(str(i) for i in failed))
+
+
+def stitch(tilenames, outname):
+    """ Stack the strip tiles in 'tilenames' (top first) into one EXR.
+    Each tile's rows are written as soon as it is decoded, so only one
+    tile is held in memory at a time."""
+    import Imath
+    import OpenEXR
+    exrimgs = [load_exr(fn) for fn in tilenames]
+    dims = [get_exr_dims(exrimg) for exrimg in exrimgs]
+    width = dims[0][0]
+    if any(w != width for w, h in dims):
+        raise ValueError("Tile widths do not match: %s" %
+                         ", ".join(str(w) for w, h in dims))
+    height = sum(h for w, h in dims)
+    # Channels present in the first tile, in the usual order.
+    header_chans = exrimgs[0].header()["channels"]
+    outchans = "".join(c for c in "RGBAZ" if c in header_chans)
+    # Write the output file, one tile's scanlines at a time.
+    header = OpenEXR.Header(width, height)
+    half = Imath.Channel(Imath.PixelType(Imath.PixelType.HALF))
+    header["channels"] = dict((c, half) for c in outchans)
+    exrout = OpenEXR.OutputFile(outname, header)
+    try:
+        for exrimg, (w, h) in zip(exrimgs, dims):
+            channels = get_channels(exrimg, outchans=outchans)
+            exrout.writePixels(dict((c, chan.tobytes())
+                                    for c, chan in zip(outchans, channels)),
+                               h)
+    finally:
+        exrout.close()
+
+
+def run(blendfile, frame, n, outname, blender="blender", threads=None,
+        args=(), keep=False):
+    """ Render 'frame' of 'blendfile' in 'n' regions and stitch them
+    into 'outname'."""
+    tmpdir = tempfile.mkdtemp(prefix="regions_",
+                              dir=os.path.dirname(os.path.abspath(outname)))
+    try:
+        tilebases = [os.path.join(tmpdir, "tile_{:03d}".format(i))
+                     for i in range(n)]
+        cmds = region_commands(os.path.abspath(blendfile), frame, tilebases,
+                               blender=blender, threads=threads, args=args)
+        render_regions(cmds)
+        # Blender appends the file extension to each tile.
+        stitch([tb + ".exr" for tb in tilebases], outname)
+    finally:
+        if not keep:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    ## Cmd line interface.
+    # Arguments after "--" are passed through to render_runner.py.
+    try:
+        idx = sys.argv.index("--")
+    except ValueError:
+        idx = len(sys.argv)
+    args, runner_args = sys.argv[1:idx], sys.argv[idx + 1:]
+    parser = ArgumentParser(description=__doc__)
+    # Argument: .blend file.
+    parser.add_argument("blendfile", help="Input .blend file.")
+    # Argument: frame.
+    parser.add_argument("--render-frame", "-f", type=int, default=1,
+                        help="Frame to render.")
+    # Argument: number of regions.
+    parser.add_argument("--regions", "-n", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of regions (and processes).")
+    # Argument: output file name.
+    parser.add_argument("--render-output", "-o", required=True,
+                        help="Output .exr file name.")
+    # Argument: Blender executable.
+    parser.add_argument("--blender", default="blender",
+                        help="Blender executable.")
+    # Argument: threads per process.
+    parser.add_argument("--threads", "-t", type=int, default=None,
+                        help="Threads per process. Defaults to cores / N.")
+    # Argument: keep tiles.
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the intermediate tiles.")
+    parsed = parser.parse_args(args)
+    run(parsed.blendfile, parsed.render_frame, parsed.regions,
+        parsed.render_output, blender=parsed.blender,
+        threads=parsed.threads, args=runner_args, keep=parsed.keep)
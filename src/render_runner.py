@@ -4,16 +4,13 @@ try:
     import bpy
 except ImportError:
     bpy = None
-import inspect
 import os
 import signal
 import sys
-#
-from pdb import set_trace as BP
-
-
-class DeviceError(Exception):
-    pass
+import traceback
+# Blender doesn't put the script's directory on the path.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cycles_device import gpu_devices
 
 
 def kill_blender():
@@ -21,12 +18,25 @@ def kill_blender():
     os.kill(os.getpid(), signal.SIGUSR1)
 
 
-gpu_devices = ("CUDA", "OPENCL")
-
-
 def blender_run(f_anim, device_t=None, scenes=False, samples=None,
-                frame=None, start=None, end=None, jump=None, output=None):
+                frame=None, start=None, end=None, jump=None, output=None,
+                f_autotune=False, f_tuning=True, border=None, post=None,
+                post_formats=("npy",)):
     """ Run rendering procedures."""
+    # Imported here rather than at module load.
+    from cycles_device import select_best_device, set_device
+    from render_tuning import apply_tuning, autotune, load_tuning
+
+    def set_border(scene, border):
+        """ Render only the 'border' region (min_x, max_x, min_y, max_y,
+        as fractions of the frame), cropped, to a half-float EXR."""
+        rs = scene.render
+        rs.use_border = True
+        rs.use_crop_to_border = True
+        (rs.border_min_x, rs.border_max_x,
+         rs.border_min_y, rs.border_max_y) = border
+        rs.image_settings.file_format = "OPEN_EXR"
+        rs.image_settings.color_depth = "16"
 
     def render(f_anim, scene, device, samples, frame, output):
         """ Set the scene and do the render."""
@@ -34,6 +44,13 @@ def blender_run(f_anim, device_t=None, scenes=False, samples=None,
         scene.cycles.device = device
         # Print device setting.
         print(scene.cycles.device)
+        # Apply the saved CPU thread/tile tuning for this scene and host.
+        if device == "CPU" and f_tuning:
+            config = load_tuning(scene)
+            if config is not None:
+                apply_tuning(scene, config)
+                print("Tuning: threads={threads} tile={tile}".format(
+                    **config))
         # Set number of samples.
         if samples:
             scene.cycles.samples = samples
@@ -47,31 +64,24 @@ def blender_run(f_anim, device_t=None, scenes=False, samples=None,
             fn = scene.name + "_"
             if not f_anim:
                 fn += "{:04d}".format(scene.frame_current)
-        scene.render.filepath = "//{}".format(fn)
+        if border is not None:
+            set_border(scene, border)
+        # Paths are relative to the .blend file unless absolute.
+        if os.path.isabs(fn):
+            scene.render.filepath = fn
+        else:
+            scene.render.filepath = "//{}".format(fn)
         scene.update()
         # Render.
         bpy.ops.render.render(animation=f_anim, write_still=not f_anim,
                               scene=scene.name)
 
-    # Local nicknames.
-    bcups = bpy.context.user_preferences.system
-    # Select the compute device and set it to render to that one
-    if device_t in gpu_devices:
-        # Device selection.
-        bcups.compute_device_type = device_t
-        # Print devices
-        print(bcups.compute_device_type, bcups.compute_device)
-        if not bcups.compute_device.startswith(device_t):
-            raise DeviceError("Failed to set compute device: %s" % device_t)
-        device = "GPU"
+    # Select the compute device and set it to render to that one.
+    if device_t == "AUTO":
+        # Use the best available device, falling back to the CPU.
+        device = select_best_device()
     else:
-        # Device selection.
-        bcups.compute_device_type = "NONE"
-        # Print devices
-        print(bcups.compute_device_type, bcups.compute_device)
-        if not bcups.compute_device.startswith("CPU"):
-            raise DeviceError("Failed to set compute device: CPU")
-        device = "CPU"
+        device = set_device(device_t)
     # Make the list of scenes.
     if scenes:
         if len(scenes) == 1:
@@ -80,14 +90,33 @@ def blender_run(f_anim, device_t=None, scenes=False, samples=None,
             scenes = bpy.data.scenes[slice(*scenes)]
     else:
         scenes = [bpy.context.scene]
+    # Post-render pipeline (optional).
+    if post is not None:
+        from render_hooks import PostRender
+        post = PostRender(post, formats=post_formats, animation=f_anim)
     # Loop over scenes.
-    for scene in scenes:
-        bpy.context.screen.scene = scene
-        if start is not None:
-            scene.frame_start = start
-        if end is not None:
-            scene.frame_end = end
-        render(f_anim, scene, device, samples, frame, output)
+    try:
+        for scene in scenes:
+            bpy.context.screen.scene = scene
+            if start is not None:
+                scene.frame_start = start
+            if end is not None:
+                scene.frame_end = end
+            if f_autotune and device == "CPU":
+                # Benchmark CPU thread counts and tile sizes, and save the
+                # best.
+                autotune(scene)
+            if post is not None:
+                # Read, transform and write each frame after it renders.
+                post.setup(scene)
+                post.register()
+            render(f_anim, scene, device, samples, frame, output)
+            if post is not None:
+                post.unregister()
+    finally:
+        if post is not None:
+            # Wait for the pending writes.
+            post.close()
 
 
 def run():
@@ -118,6 +147,7 @@ def run():
     except ValueError:
         # "--" isn't an argument, start with next argument after this script.
         # Determine which argument this script is.
+        import inspect
         thisfile = os.path.basename(inspect.getfile(inspect.currentframe()))
         idx = None
         for i, a in enumerate(sys.argv):
@@ -139,10 +169,11 @@ def run():
         "--render-anim", "-a", action="store_true", default=False,
         help="Render frames from start to end.")
     # Argument: device.
-    devices = gpu_devices + ("CPU",)
+    devices = gpu_devices + ("CPU", "AUTO")
     parser.add_argument(
         "--device", "-D", choices=devices,
-        help="Sets compute device: (%s)" % (", ".join(devices)))
+        help="Sets compute device: (%s). AUTO picks the best available "
+        "one, falling back to CPU." % (", ".join(devices)))
     # Argument: samples.
     parser.add_argument(
         "--samples", default=None, type=int,
@@ -171,6 +202,33 @@ def run():
     parser.add_argument(
         "--render-output", "-o", default=None,
         help="Set the render path and file name.")
+    # Argument: border
+    parser.add_argument(
+        "--border", nargs=4, default=None, type=float,
+        metavar=("MIN_X", "MAX_X", "MIN_Y", "MAX_Y"),
+        help="Render only this region (fractions of the frame), cropped, "
+        "to an EXR.")
+    # Argument: post
+    parser.add_argument(
+        "--post", nargs="*", default=None, metavar="TRANSFORM",
+        help="Read each rendered frame from the Viewer buffer, apply these "
+        "transforms (depth, nanfill[:value], normalize[:chans[,nanfill]], "
+        "downsample[:factor]) and write --post-formats in the background.")
+    # Argument: post formats
+    parser.add_argument(
+        "--post-formats", nargs="+", default=["npy"], metavar="FORMAT",
+        help="File formats written by --post (npy, exr, png, ...). Only npy "
+        "works with Blender's bundled Python; exr needs OpenEXR and image "
+        "formats need scipy.misc.imsave.")
+    # Argument: f_autotune.
+    parser.add_argument(
+        "--autotune", action="store_true", default=False,
+        help="Benchmark CPU thread counts and tile sizes for each scene and "
+        "save the fastest for this host before rendering.")
+    # Argument: f_no_tuning.
+    parser.add_argument(
+        "--no-tuning", action="store_true", default=False,
+        help="Don't apply saved CPU thread/tile tuning.")
     # Argument: f_no_kill.
     parser.add_argument(
         "--no-kill", action="store_true", default=False,
@@ -188,11 +246,6 @@ def run():
             # Abnormal exit.
             # Re-raise error.
             raise err
-            # Exit script and exit Blender.
-            sys.exit(err.code)
-            bpy.ops.wm.quit_blender()
-            BP()
-            kill_blender()
     # Get parsed arguments.
     f_anim = parsed.render_anim
     device_t = parsed.device
@@ -204,12 +257,19 @@ def run():
     end = parsed.frame_end
     jump = parsed.frame_jump
     output = parsed.render_output
+    border = parsed.border
+    post = parsed.post
+    post_formats = parsed.post_formats
+    f_autotune = parsed.autotune
+    f_tuning = not parsed.no_tuning
     f_kill = not parsed.no_kill
     if bpy:
         # Render.
         blender_run(f_anim, device_t=device_t, samples=samples, scenes=scenes,
                     frame=frame, start=start, end=end, jump=jump,
-                    output=output)
+                    output=output, f_autotune=f_autotune,
+                    f_tuning=f_tuning, border=border, post=post,
+                    post_formats=post_formats)
     else:
         print("** Called from outside Blender. Exiting. **")
     # Kill blender. This script is intended to be used as a final
@@ -221,10 +281,28 @@ def run():
         kill_blender()
 
 
-if __name__ == "__main__":
-    ## Cmd line interface.
+def main():
+    """ Call run() and return an exit code instead of raising, so
+    unattended jobs exit rather than wait at a debugger prompt. Set the
+    RENDER_RUNNER_PDB environment variable to debug errors instead."""
     try:
         run()
-    except:
+    except SystemExit as err:
+        return err.code
+    except Exception:
+        traceback.print_exc()
         print("\n\nError generated from Python script.")
-        BP()
+        if os.environ.get("RENDER_RUNNER_PDB"):
+            import pdb
+            pdb.post_mortem()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    ## Cmd line interface.
+    # Blender quits on SystemExit, so only exit on failure; on success
+    # Blender goes on to its remaining arguments (with "--no-kill").
+    code = main()
+    if code:
+        sys.exit(code)
@@ -0,0 +1,141 @@
+""" Autotunes Cycles CPU thread count and tile size.
+
+A short benchmark of a scene is rendered over a grid of thread counts
+and tile sizes, and the fastest configuration is saved per (scene,
+host) so later renders can apply it automatically.
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import socket
+import time
+try:
+    import bpy
+except ImportError:
+    bpy = None
+from cycles_device import CACHE_DIR, write_json
+
+
+# Default tile sizes (square, in pixels) to benchmark.
+TILE_SIZES = (16, 32, 64, 128, 256)
+# Default number of samples for the benchmark renders.
+BENCH_SAMPLES = 16
+
+
+def default_threads():
+    """ Return the default grid of thread counts: powers of two up to
+    (and including) the number of cores."""
+    import multiprocessing
+    ncpu = multiprocessing.cpu_count()
+    threads = []
+    n = 1
+    while n < ncpu:
+        threads.append(n)
+        n *= 2
+    threads.append(ncpu)
+    return tuple(threads)
+
+
+def scene_key(scene):
+    """ Return the key that identifies 'scene'."""
+    return "{}:{}".format(os.path.abspath(bpy.data.filepath), scene.name)
+
+
+def tuning_file(key, hostname=None, cache_dir=None):
+    """ Return the tuning file name for scene key 'key' on 'hostname'.
+    Each (scene, host) has its own file, so concurrent autotune jobs
+    don't overwrite each other's results."""
+    if hostname is None:
+        hostname = socket.gethostname()
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, "tuning_{}_{}.json".format(hostname,
+                                                             digest))
+
+
+def load_tuning(scene, hostname=None, cache_dir=None):
+    """ Return the saved tuning for 'scene', or None."""
+    key = scene_key(scene)
+    fn = tuning_file(key, hostname=hostname, cache_dir=cache_dir)
+    try:
+        with open(fn, "r") as fid:
+            config = json.load(fid)
+    except (IOError, OSError, ValueError):
+        return None
+    # Guard against digest collisions.
+    if not isinstance(config, dict) or config.get("key") != key:
+        return None
+    return config
+
+
+def save_tuning(scene, config, hostname=None, cache_dir=None):
+    """ Save 'config' as the tuning for 'scene'."""
+    key = scene_key(scene)
+    config = dict(config, key=key)
+    write_json(tuning_file(key, hostname=hostname, cache_dir=cache_dir),
+               config)
+
+
+def apply_tuning(scene, config):
+    """ Set 'scene's thread count and tile size from 'config'."""
+    scene.render.threads_mode = "FIXED"
+    scene.render.threads = config["threads"]
+    scene.render.tile_x = config["tile"]
+    scene.render.tile_y = config["tile"]
+
+
+@contextmanager
+def render_settings(scene):
+    """ Context manager for restoring 'scene's render settings that the
+    benchmark changes."""
+    rs = scene.render
+    settings = (rs.threads_mode, rs.threads, rs.tile_x, rs.tile_y,
+                scene.cycles.samples)
+    try:
+        yield scene
+    finally:
+        (rs.threads_mode, rs.threads, rs.tile_x, rs.tile_y,
+         scene.cycles.samples) = settings
+
+
+def benchmark(scene, threads=None, tiles=None, samples=BENCH_SAMPLES):
+    """ Render 'scene' once per (threads, tile) pair and return a list
+    of timing records."""
+    if threads is None:
+        threads = default_threads()
+    if tiles is None:
+        tiles = TILE_SIZES
+    timings = []
+    with render_settings(scene):
+        scene.cycles.samples = samples
+        # Render once untimed, so the first grid point doesn't also pay
+        # for loading the scene and kernels.
+        bpy.ops.render.render(write_still=False, scene=scene.name)
+        for n in threads:
+            for tile in tiles:
+                config = {"threads": n, "tile": tile}
+                apply_tuning(scene, config)
+                scene.update()
+                t0 = time.time()
+                bpy.ops.render.render(write_still=False, scene=scene.name)
+                config["time"] = time.time() - t0
+                print("threads={threads} tile={tile}: {time:.2f}s".format(
+                    **config))
+                timings.append(config)
+    return timings
+
+
+def autotune(scene, threads=None, tiles=None, samples=BENCH_SAMPLES,
+             hostname=None, cache_dir=None):
+    """ Benchmark 'scene', save the fastest configuration and return
+    it."""
+    timings = benchmark(scene, threads=threads, tiles=tiles,
+                        samples=samples)
+    best = dict(min(timings, key=lambda c: c["time"]))
+    best["samples"] = samples
+    best["timings"] = timings
+    save_tuning(scene, best, hostname=hostname, cache_dir=cache_dir)
+    print("Best: threads={threads} tile={tile}".format(**best))
+    return best
@@ -0,0 +1,304 @@
+""" Tests the Blender-side scripts against the fake bpy in fake_bpy.py."""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import fake_bpy
+recorder = fake_bpy.install()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "demo"))
+import create_scenes
+import cycles_device
+import estimate_mass
+import render_hooks
+import render_runner
+import render_tuning
+
+
+@pytest.fixture(autouse=True)
+def fresh_bpy(monkeypatch, tmp_path):
+    """ Reset the fake's data and keep caches out of the home directory."""
+    fake_bpy.reset()
+    monkeypatch.setattr(cycles_device, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(render_tuning, "CACHE_DIR", str(tmp_path))
+    yield
+
+
+def test_blender_run_sets_scenes_and_renders_each_once():
+    scenes = fake_bpy.new_scenes(3)
+    recorder.clear()
+    render_runner.blender_run(False, device_t="CPU", scenes=[0, 3],
+                              samples=16, frame=7)
+    for scene in scenes:
+        assert scene.cycles.device == "CPU"
+        assert scene.cycles.samples == 16
+        assert scene.frame_current == 7
+        assert scene.render.filepath == "//{}_0007".format(scene.name)
+    renders = [kw for name, kw in recorder.ops if name == "render.render"]
+    assert [kw["scene"] for kw in renders] == [s.name for s in scenes]
+    assert all(kw["write_still"] and not kw["animation"] for kw in renders)
+
+
+def test_create_polys_names_and_materials():
+    polys = [[(0, 0), (1, 0), (1, 1)], [(0, 0, 0), (1, 0, 0), (0, 1, 1)]]
+    create_scenes.create_polys(polys)
+    objs = fake_bpy.bpy.context.scene.objects
+    assert [o.name for o in objs] == ["Poly_00", "Poly_01"]
+    assert all(o.data.materials[0].name == "Stone" for o in objs)
+    # Only the poly without z coordinates is extruded.
+    extrudes = [name for name, kw in recorder.ops
+                if name == "mesh.extrude_region_move"]
+    assert len(extrudes) == 1
+    assert list(objs[1].data.vertices[2].co) == [0, 1, 1]
+
+
+def test_get_com_moi_matches_unit_cube():
+    obj = fake_bpy.Object("Cube")
+    scene = fake_bpy.bpy.context.scene
+    scene.objects.append(obj)
+    scene.objects.active = obj
+    com, moi = estimate_mass.get_com_moi(obj, count=200000)
+    # Uniform unit cube: com at its center, moi (per unit mass) 1/6.
+    assert com == pytest.approx([0.5] * 3, abs=0.005)
+    assert moi == pytest.approx([1. / 6] * 3, abs=0.005)
+    # The particle system is removed again.
+    assert obj.particle_systems == []
+
+
+def test_select_best_device_falls_back_to_cpu():
+    prefs = fake_bpy.SystemPrefs()
+    assert cycles_device.select_best_device(bcups=prefs) == "CPU"
+    assert prefs.compute_device_type == "NONE"
+
+
+def test_select_best_device_finds_gpu_added_after_caching():
+    prefs = fake_bpy.SystemPrefs()
+    # Cache an inventory without GPUs, then add one.
+    cycles_device.get_devices(prefs, key="k")
+    prefs.inventory = {"NONE": ["CPU"], "CUDA": ["CUDA_0"], "OPENCL": []}
+    assert cycles_device.select_best_device(bcups=prefs) == "GPU"
+    assert prefs.compute_device_type == "CUDA"
+    assert cycles_device.select_best_device(("OPENCL",), bcups=prefs) == \
+        "CPU"
+
+
+def test_get_devices_caches_until_refresh():
+    prefs = fake_bpy.SystemPrefs()
+    first = cycles_device.get_devices(prefs, key="k")
+    assert first["CUDA"] == []
+    prefs.inventory = {"NONE": ["CPU"], "CUDA": ["CUDA_0"], "OPENCL": []}
+    assert cycles_device.get_devices(prefs, key="k") == first
+    assert cycles_device.get_devices(prefs, key="k",
+                                     refresh=True)["CUDA"] == ["CUDA_0"]
+    # Probing restores the initial device type.
+    assert prefs.compute_device_type == "NONE"
+
+
+def test_save_load_tuning_round_trip(tmp_path):
+    scene = fake_bpy.bpy.context.scene
+    assert render_tuning.load_tuning(scene) is None
+    render_tuning.save_tuning(scene, {"threads": 4, "tile": 32},
+                              hostname="h")
+    config = render_tuning.load_tuning(scene, hostname="h")
+    assert config["threads"] == 4 and config["tile"] == 32
+    assert render_tuning.load_tuning(scene, hostname="other") is None
+    # Each (scene, host) has its own file, and nothing is left over.
+    assert [p.name for p in tmp_path.iterdir()] == [os.path.basename(
+        render_tuning.tuning_file(render_tuning.scene_key(scene), "h"))]
+
+
+def test_load_tuning_rejects_other_key():
+    scene = fake_bpy.bpy.context.scene
+    key = render_tuning.scene_key(scene)
+    # Another scene's tuning in this scene's file (a digest collision).
+    cycles_device.write_json(render_tuning.tuning_file(key, "h"),
+                             {"threads": 4, "tile": 32, "key": "other"})
+    assert render_tuning.load_tuning(scene, hostname="h") is None
+    # Re-saving replaces the existing file.
+    render_tuning.save_tuning(scene, {"threads": 2, "tile": 16},
+                              hostname="h")
+    assert render_tuning.load_tuning(scene, hostname="h")["threads"] == 2
+
+
+def test_apply_tuning():
+    scene = fake_bpy.bpy.context.scene
+    render_tuning.apply_tuning(scene, {"threads": 3, "tile": 128})
+    rs = scene.render
+    assert (rs.threads_mode, rs.threads, rs.tile_x, rs.tile_y) == \
+        ("FIXED", 3, 128, 128)
+
+
+def test_benchmark_warms_up_and_restores_settings():
+    scene = fake_bpy.bpy.context.scene
+    recorder.clear()
+    timings = render_tuning.benchmark(scene, threads=(1, 2), tiles=(16,),
+                                      samples=4)
+    assert [(c["threads"], c["tile"]) for c in timings] == [(1, 16),
+                                                              (2, 16)]
+    # One untimed render, then one per grid point.
+    renders = [kw for name, kw in recorder.ops if name == "render.render"]
+    assert len(renders) == 3
+    rs = scene.render
+    assert (rs.threads_mode, rs.threads, rs.tile_x, scene.cycles.samples) \
+        == ("AUTO", 1, 64, 10)
+
+
+@pytest.mark.parametrize("device_t, f_tuning, applied", [
+    ("CPU", True, True),
+    ("CPU", False, False),
+    ("CUDA", True, False),
+])
+def test_blender_run_applies_saved_tuning(device_t, f_tuning, applied):
+    prefs = fake_bpy.bpy.context.user_preferences.system
+    prefs.inventory = {"NONE": ["CPU"], "CUDA": ["CUDA_0"], "OPENCL": []}
+    scene = fake_bpy.bpy.context.scene
+    render_tuning.save_tuning(scene, {"threads": 3, "tile": 128})
+    render_runner.blender_run(False, device_t=device_t, f_tuning=f_tuning)
+    rs = scene.render
+    assert (rs.threads_mode == "FIXED") == applied
+    assert (rs.threads, rs.tile_x, rs.tile_y) == \
+        ((3, 128, 128) if applied else (1, 64, 64))
+
+
+def test_depth_keeps_first_channel():
+    img = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+    out, chans = render_hooks.depth(img, "RGBA")
+    assert chans == "Z"
+    assert out.shape == (2, 3, 1)
+    assert np.array_equal(out[:, :, 0], img[:, :, 0])
+
+
+def test_normalize_and_nanfill():
+    img = np.array([[[1., 2., np.nan, 4.], [2., np.inf, 1., 2.]]])
+    out, chans = render_hooks.normalize(img.copy(), "RGBA", "RGBA,-1")
+    assert chans == "RGBA"
+    # RGB and A are normalized separately; the fill value isn't scaled.
+    assert out.tolist() == [[[.5, 1., -1., 1.], [1., -1., .5, .5]]]
+    out, chans = render_hooks.nanfill(img.copy(), "RGBA", "7")
+    assert out.tolist() == [[[1., 2., 7., 4.], [2., 7., 1., 2.]]]
+
+
+def test_downsample_averages_blocks():
+    img = np.arange(30, dtype=np.float32).reshape(5, 3, 2)
+    out, chans = render_hooks.downsample(img, "ZA", "2")
+    # Rows and columns that don't fill a block are dropped.
+    assert out.shape == (2, 1, 2)
+    assert out[0, 0].tolist() == img[:2, :2].mean(axis=(0, 1)).tolist()
+
+
+def test_parse_transform():
+    assert render_hooks.parse_transform("downsample:4") == \
+        ("downsample", render_hooks.downsample, "4")
+    assert render_hooks.parse_transform("depth") == \
+        ("depth", render_hooks.depth, None)
+    with pytest.raises(ValueError):
+        render_hooks.parse_transform("blur:2")
+    with pytest.raises(ValueError):
+        render_hooks.PostRender(["nanfill:1", "normalize:RGB"])
+
+
+def add_viewer_image(w=4, h=2):
+    """ Add a 'w' x 'h' RGBA Viewer Node image and return its pixels."""
+    pixels = np.arange(w * h * 4, dtype=np.float32)
+    fake_bpy.bpy.data.images.append(fake_bpy.Struct(
+        name="Viewer Node", size=(w, h), channels=4, pixels=list(pixels)))
+    return pixels
+
+
+@pytest.mark.parametrize("f_anim, expected", [
+    (False, ["out_post.npy"]),
+    (True, ["out0001_post.npy", "out0002_post.npy"]),
+])
+def test_blender_run_post_writes_suffixed_frames(tmp_path, f_anim,
+                                                 expected):
+    scene = fake_bpy.bpy.context.scene
+    pixels = add_viewer_image()
+    render_runner.blender_run(f_anim, device_t="CPU", start=1, end=2,
+                              output=str(tmp_path / "out"),
+                              post=["depth", "downsample:2"])
+    # Never Blender's own output name (the render path, plus the frame).
+    assert sorted(os.listdir(str(tmp_path))) == expected
+    # Bottom row first in Blender, so it is flipped; then 2x2 blocks of
+    # the first channel are averaged.
+    img = pixels.reshape(2, 4, 4)[::-1, :, :1]
+    out = np.load(str(tmp_path / expected[-1]))
+    assert out.tolist() == img.reshape(1, 2, 2, 2, 1).mean(
+        axis=(1, 3)).tolist()
+    # The compositor settings changed for reading pixels are restored.
+    assert ("Struct", "use_pass_z", True) in recorder.writes
+    assert not scene.use_nodes
+    assert not scene.render.use_compositing
+    assert not scene.render.layers.active.use_pass_z
+    assert scene.node_tree.nodes == [] and scene.node_tree.links == []
+    assert fake_bpy.bpy.app.handlers.render_post == []
+
+
+def test_post_keeps_existing_compositor_nodes(tmp_path):
+    scene = fake_bpy.bpy.context.scene
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    tree.nodes.new("CompositorNodeRLayers")
+    blur = tree.nodes.new("CompositorNodeBlur")
+    viewer = tree.nodes.new("CompositorNodeViewer")
+    link = tree.links.new(blur.outputs["Image"], viewer.inputs["Image"])
+    tree.nodes.active = blur
+    nodes = list(tree.nodes)
+    add_viewer_image()
+    render_runner.blender_run(False, device_t="CPU",
+                              output=str(tmp_path / "out"), post=[])
+    assert os.listdir(str(tmp_path)) == ["out_post.npy"]
+    # The added Viewer and its link are removed again.
+    assert tree.nodes == nodes and tree.links == [link]
+    assert tree.nodes.active is blur
+    assert scene.use_nodes and scene.render.use_compositing
+
+
+def test_post_refuses_to_turn_on_compositing_for_node_tree(tmp_path):
+    scene = fake_bpy.bpy.context.scene
+    scene.node_tree.nodes.new("CompositorNodeBlur")
+    add_viewer_image()
+    with pytest.raises(ValueError):
+        render_runner.blender_run(False, device_t="CPU",
+                                  output=str(tmp_path / "out"), post=[])
+    assert not scene.use_nodes and not scene.render.use_compositing
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_post_write_errors_are_raised_after_rendering(monkeypatch,
+                                                      tmp_path):
+    written = []
+
+    def write_fail(filename, img, chans):
+        written.append(os.path.basename(filename))
+        if len(written) == 1:
+            raise IOError("disk full")
+    monkeypatch.setitem(render_hooks.WRITERS, "fail", write_fail)
+    add_viewer_image()
+    # Blender (and the fake) print handler errors instead of raising
+    # them, so the error must come from close().
+    with pytest.raises(IOError, match="disk full"):
+        render_runner.blender_run(True, device_t="CPU", start=1, end=4,
+                                  output=str(tmp_path / "out"), post=[],
+                                  post_formats=["fail"])
+    # The other frames are still written.
+    assert sorted(written) == ["out{:04d}_post.fail".format(i)
+                               for i in range(1, 5)]
+
+
+def test_main_returns_2_on_argument_error(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["blender", "--", "--device", "TPU"])
+    assert render_runner.main() == 2
+
+
+def test_main_returns_1_without_debugger(monkeypatch):
+    def post_mortem(*args):
+        raise AssertionError("entered pdb")
+    import pdb
+    monkeypatch.setattr(pdb, "post_mortem", post_mortem)
+    monkeypatch.delenv("RENDER_RUNNER_PDB", raising=False)
+    # No CUDA device, so set_device raises DeviceError.
+    monkeypatch.setattr(sys, "argv", ["blender", "--", "--device", "CUDA"])
+    assert render_runner.main() == 1
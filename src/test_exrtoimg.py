@@ -0,0 +1,36 @@
+""" Tests exrtoimg's command line error paths."""
+import os
+import subprocess
+import sys
+
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+# Imported only when converting, so errors exit without loading them.
+HEAVY = ("numpy", "OpenEXR", "Imath", "scipy")
+
+
+def run_main(args, cwd):
+    """ Call exrtoimg.main(args) in a fresh Python process and return
+    (exit code, heavy modules imported)."""
+    code = ("import sys, exrtoimg\n"
+            "code = exrtoimg.main({!r})\n"
+            "print(code, sorted(m for m in {!r} if m in sys.modules))\n"
+            ).format(args, HEAVY)
+    env = dict(os.environ, PYTHONPATH=SRC)
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=cwd,
+                                  env=env, universal_newlines=True)
+    code, modules = out.strip().split(" ", 1)
+    return int(code), modules
+
+
+def test_main_fails_without_inputs(tmp_path):
+    assert run_main(["missing_*.exr"], str(tmp_path)) == (1, "[]")
+
+
+def test_main_refuses_to_overwrite(tmp_path):
+    tmp_path.joinpath("in.exr").write_bytes(b"")
+    tmp_path.joinpath("out.png").write_bytes(b"old")
+    assert run_main(["in.exr", "-o", "out.png"], str(tmp_path)) == \
+        (1, "[]")
+    assert tmp_path.joinpath("out.png").read_bytes() == b"old"
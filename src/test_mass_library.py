@@ -0,0 +1,114 @@
+""" Tests mass_library's point-in-mesh sampling on simple meshes."""
+import math
+
+import numpy as np
+import pytest
+
+import mass_library
+
+
+def cube():
+    """ Return the unit cube [0, 1]^3 as (verts, tris)."""
+    verts = np.array([(x, y, z) for x in (0, 1) for y in (0, 1)
+                      for z in (0, 1)], dtype=np.float64)
+    quads = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1),
+             (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    tris = np.array([t for a, b, c, d in quads
+                     for t in ((a, b, c), (a, c, d))], dtype=np.int64)
+    return verts, tris
+
+
+def uv_sphere(segments=48, rings=24):
+    """ Return a unit-radius UV sphere centered at the origin as (verts,
+    tris)."""
+    verts = [(0., 0., 1.)]
+    for i in range(1, rings):
+        theta = math.pi * i / rings
+        for j in range(segments):
+            phi = 2 * math.pi * j / segments
+            verts.append((math.sin(theta) * math.cos(phi),
+                          math.sin(theta) * math.sin(phi), math.cos(theta)))
+    verts.append((0., 0., -1.))
+    bottom = len(verts) - 1
+
+    def ring(i, j):
+        return 1 + (i - 1) * segments + j % segments
+    tris = []
+    for j in range(segments):
+        tris.append((0, ring(1, j), ring(1, j + 1)))
+        tris.append((bottom, ring(rings - 1, j + 1), ring(rings - 1, j)))
+        for i in range(1, rings - 1):
+            a, b = ring(i, j), ring(i, j + 1)
+            c, d = ring(i + 1, j + 1), ring(i + 1, j)
+            tris.extend([(a, d, c), (a, c, b)])
+    return np.array(verts), np.array(tris, dtype=np.int64)
+
+
+def test_is_closed():
+    verts, tris = cube()
+    assert mass_library.is_closed(tris)
+    assert mass_library.is_closed(uv_sphere()[1])
+    # A missing triangle leaves edges on only one triangle.
+    assert not mass_library.is_closed(tris[1:])
+    assert not mass_library.is_closed(np.zeros((0, 3), dtype=np.int64))
+
+
+def test_com_moi_unit_cube():
+    com, moi = mass_library.com_moi(*cube(), count=20000)
+    assert com == pytest.approx([0.5] * 3, abs=0.01)
+    assert moi == pytest.approx([1. / 6] * 3, abs=0.01)
+
+
+def test_com_moi_sphere():
+    com, moi = mass_library.com_moi(*uv_sphere(), count=20000)
+    assert com == pytest.approx([0.] * 3, abs=0.02)
+    # Solid sphere of radius 1: 2/5 (per unit mass).
+    assert moi == pytest.approx([0.4] * 3, abs=0.02)
+
+
+def test_com_moi_open_and_empty_give_nans():
+    verts, tris = cube()
+    empty = (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+    for mesh in ((verts, tris[1:]), empty):
+        com, moi = mass_library.com_moi(*mesh, count=100)
+        assert np.isnan(com).all() and np.isnan(moi).all()
+
+
+def test_pack_library_offsets():
+    meshes = [cube(), uv_sphere(8, 4)]
+    verts, tris, vert_offsets, tri_offsets = mass_library.pack_library(
+        meshes)
+    for i, (v, t) in enumerate(meshes):
+        np.testing.assert_array_equal(
+            verts[vert_offsets[i]:vert_offsets[i + 1]], v)
+        np.testing.assert_array_equal(
+            tris[tri_offsets[i]:tri_offsets[i + 1]], t)
+
+
+def test_load_library_round_trip(tmp_path):
+    meshes = [cube(), uv_sphere(8, 4), cube()]
+    verts, tris, vert_offsets, tri_offsets = mass_library.pack_library(
+        meshes)
+    fn = str(tmp_path / "library.npz")
+    np.savez(fn, names=np.array(["a", "b", "c"]), verts=verts, tris=tris,
+             vert_offsets=vert_offsets, tri_offsets=tri_offsets)
+    names, loaded = mass_library.load_library(fn)
+    assert names == ["a", "b", "c"]
+    assert len(loaded) == len(meshes)
+    for (v, t), (lv, lt) in zip(meshes, loaded):
+        np.testing.assert_array_equal(lv, v)
+        np.testing.assert_array_equal(lt, t)
+
+
+def test_iter_com_moi_across_processes():
+    verts, tris = cube()
+    meshes = [cube(), (verts + 2, tris), (verts, tris[1:])]
+    results = dict((i, (com, moi)) for i, com, moi in
+                   mass_library.iter_com_moi(meshes, count=5000,
+                                             processes=2))
+    assert sorted(results) == [0, 1, 2]
+    assert results[0][0] == pytest.approx([0.5] * 3, abs=0.02)
+    assert results[1][0] == pytest.approx([2.5] * 3, abs=0.02)
+    assert results[1][1] == pytest.approx([1. / 6] * 3, abs=0.02)
+    # The open mesh gives NaNs without stopping the others.
+    assert np.isnan(results[2][0]).all()
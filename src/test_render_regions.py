@@ -0,0 +1,100 @@
+""" Tests render_regions against stub OpenEXR and Imath modules."""
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import render_regions
+
+
+class Box(object):
+    def __init__(self, x, y):
+        self.x, self.y = x, y
+
+
+class InputFile(object):
+    """ Stub EXR reader over in-memory tiles: {filename: {chan: array}}."""
+    tiles = {}
+
+    def __init__(self, filename):
+        self.chans = self.tiles[filename]
+
+    def header(self):
+        h, w = next(iter(self.chans.values())).shape
+        return {"dataWindow": types.SimpleNamespace(min=Box(0, 0),
+                                                    max=Box(w - 1, h - 1)),
+                "channels": dict((c, None) for c in self.chans)}
+
+    def channels(self, outchans, pt):
+        return [self.chans[c].astype(np.float16).tobytes() for c in outchans]
+
+
+class OutputFile(object):
+    """ Stub EXR writer that keeps the written scanlines."""
+    written = {}
+
+    def __init__(self, filename, header):
+        self.filename = filename
+        self.header = header
+        self.rows = dict((c, []) for c in header["channels"])
+
+    def writePixels(self, data, scanlines):
+        w = self.header["width"]
+        for c, buf in data.items():
+            rows = np.frombuffer(buf, dtype=np.float16).reshape(scanlines, w)
+            self.rows[c].append(rows)
+
+    def close(self):
+        self.written[self.filename] = dict(
+            (c, np.vstack(r)) for c, r in self.rows.items())
+
+
+@pytest.fixture
+def stub_exr(monkeypatch):
+    openexr = types.ModuleType("OpenEXR")
+    openexr.InputFile = InputFile
+    openexr.OutputFile = OutputFile
+    openexr.Header = lambda w, h: {"width": w, "height": h}
+    imath = types.ModuleType("Imath")
+    imath.PixelType = type("PixelType", (object,), {
+        "HALF": 1, "__init__": lambda self, t: None})
+    imath.Channel = lambda pt: pt
+    monkeypatch.setitem(sys.modules, "OpenEXR", openexr)
+    monkeypatch.setitem(sys.modules, "Imath", imath)
+    InputFile.tiles = {}
+    OutputFile.written = {}
+    return InputFile.tiles, OutputFile.written
+
+
+def test_regions_cover_frame_top_first():
+    regions = render_regions.regions(4)
+    assert regions[0][3] == 1. and regions[-1][2] == 0.
+    for upper, lower in zip(regions, regions[1:]):
+        assert upper[2] == lower[3]
+
+
+def test_stitch_stacks_tiles_top_first(stub_exr):
+    tiles, written = stub_exr
+    frame = np.arange(7 * 5, dtype=np.float16).reshape(7, 5)
+    # Uneven strip heights, top strip first.
+    edges = [0, 3, 5, 7]
+    names = []
+    for i in range(3):
+        name = "tile_{}.exr".format(i)
+        strip = frame[edges[i]:edges[i + 1]]
+        tiles[name] = {"R": strip, "A": strip + 1}
+        names.append(name)
+    render_regions.stitch(names, "out.exr")
+    out = written["out.exr"]
+    assert sorted(out) == ["A", "R"]
+    np.testing.assert_array_equal(out["R"], frame)
+    np.testing.assert_array_equal(out["A"], frame + 1)
+
+
+def test_stitch_rejects_mismatched_widths(stub_exr):
+    tiles, written = stub_exr
+    tiles["a.exr"] = {"R": np.zeros((2, 4))}
+    tiles["b.exr"] = {"R": np.zeros((2, 5))}
+    with pytest.raises(ValueError):
+        render_regions.stitch(["a.exr", "b.exr"], "out.exr")
@@ -1,23 +1,11 @@
 """ Sets render device for every scene to: OPENCL."""
-import bpy
+import os
+import sys
+# Blender doesn't put the script's directory on the path.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cycles_device import select_best_device, set_scenes_device
 
 
-class DeviceError(Exception):
-    pass
-
-
-def set_device(device):
-    """ Sets rendering device."""
-    # Local nickname.
-    bcups = bpy.context.user_preferences.system
-    # Device selection.
-    bcups.compute_device_type = device[0]
-    if not bcups.compute_device.startswith(device[0]):
-        raise DeviceError("Failed to set compute device: %s" % device[0])
-    # Loop over scenes
-    for scene in bpy.data.scenes:
-        setattr(scene.cycles, "device", device[1])
-
-
-device = ("OPENCL", "GPU")
-set_device(device)
+# Falls back to the CPU if OPENCL isn't available.
+device = select_best_device(("OPENCL",))
+set_scenes_device(device)